@@ -3,42 +3,65 @@ import pandas as pd
 import vectorbt as vbt
 import sqlalchemy
 import os
-from dotenv import load_dotenv
+import datetime
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from indicators import sma_running, sma_cross
+from db_config import db_config
 
-# Load environment variables
-load_dotenv()
+CSV_PATH = "sp500_market_data.csv"
+PARQUET_PATH = "sp500_market_data.parquet"
+
+@st.cache_resource
+def _engine():
+    """
+    Pooled SQLAlchemy engine, kept across reruns (rebuilt only on restart).
+    """
+    return sqlalchemy.create_engine(db_config().uri, pool_size=5, pool_pre_ping=True, pool_recycle=300)
 
 # ==========================================
-# DATA LOADING (Hybrid: CSV > Database)
+# DATA LOADING (Hybrid: Parquet > CSV > Database)
 # ==========================================
 @st.cache_data(ttl=3600)
 def get_close_data():
     """
     Fetch S&P 500 data. 
     Priority:
-    1. Local CSV (fast, stable, works for demo)
-    2. Database (live, if configured)
+    1. Local Parquet snapshot (fastest, reads only `date` and `Close`)
+    2. Local CSV (fast, stable, works for demo)
+    3. Database (live, if configured)
     """
-    # 1. Try Local CSV (Best for Streamlit Cloud / Demo)
-    csv_path = "sp500_market_data.csv"
+    # 1. Try Local Parquet (written alongside the CSV by fetch_full_data.py)
+    if os.path.exists(PARQUET_PATH):
+        try:
+            # Read only `date` / `Close` from the snapshot
+            with pa.memory_map(PARQUET_PATH) as src:
+                tbl = pq.read_table(src, columns=["date", "Close"])
+            close = pd.Series(
+                tbl.column("Close").to_numpy(),
+                index=pd.DatetimeIndex(tbl.column("date").to_numpy(), name="date"),
+                name="Close"
+            )
+            return close, "Parquet (Static Demo)"
+        except Exception as e:
+            st.warning(f"Found Parquet but failed to load: {e}")
+
+    # 2. Try Local CSV (Best for Streamlit Cloud / Demo)
+    csv_path = CSV_PATH
     if os.path.exists(csv_path):
         try:
-            df = pd.read_csv(csv_path)
-            df['date'] = pd.to_datetime(df['date'])
-            df.set_index('date', inplace=True)
+            df = pd.read_csv(
+                csv_path, engine="pyarrow", usecols=["date", "Close"], parse_dates=["date"]
+            ).set_index("date")
             return df['Close'], "CSV (Static Demo)"
         except Exception as e:
             st.warning(f"Found CSV but failed to load: {e}")
 
-    # 2. Try Database (Fallback or Live Mode)
-    db_user = os.getenv("DB_USER")
-    db_name = os.getenv("DB_NAME")
-    
-    if db_user and db_name:
+    # 3. Try Database (Fallback or Live Mode)
+    if db_config() is not None:
         try:
-            db_uri = f"postgresql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
-            engine = sqlalchemy.create_engine(db_uri)
+            engine = _engine()
             query = 'SELECT "Date", "Close" FROM sp500_daily ORDER BY "Date"'
             # Fix: Handle case sensitivity if needed, standardizing on 'Date' and 'Close'
             df = pd.read_sql(query, engine)
@@ -50,36 +73,143 @@ def get_close_data():
             
     return pd.Series(), "None"
 
-# Backtest Function (with Warm-up)
-def sma_crossover_backtest(close_price, short_window=50, long_window=200, start_date=None, end_date=None):
-    # 1. Calculate Indicators on FULL History (Warm-up)
-    fast_ma = vbt.MA.run(close_price, short_window)
-    slow_ma = vbt.MA.run(close_price, long_window)
-    
-    entries = fast_ma.ma_crossed_above(slow_ma)
-    exits = fast_ma.ma_crossed_below(slow_ma)
-    
-    # 2. Slice to User's Selected Range
+def _ffill_trim(close_price):
+    """
+    Equivalent of `close_price.ffill().dropna()` in one numpy pass:
+    NaNs can only survive ffill at the head, so trim those and forward-fill the rest.
+    """
+    v = close_price.to_numpy(dtype=np.float64)
+    valid = ~np.isnan(v)
+    if not valid.any():
+        return close_price.iloc[:0].astype(np.float64)
+
+    first = int(np.argmax(valid))
+    v, valid = v[first:], valid[first:]
+    if not valid.all():
+        # Vectorized ffill: index of the last valid value at or before each position
+        last_valid = np.where(valid, np.arange(len(v)), 0)
+        np.maximum.accumulate(last_valid, out=last_valid)
+        v = v[last_valid]
+    return pd.Series(v, index=close_price.index[first:], name=close_price.name, copy=False)
+
+def _data_version(close_price):
+    """
+    Cheap, hashable tag identifying the loaded series.
+    Includes the snapshot mtimes so a refreshed file invalidates cached signals.
+    """
+    mtimes = tuple(os.path.getmtime(p) for p in (PARQUET_PATH, CSV_PATH) if os.path.exists(p))
+    return len(close_price), close_price.index[0], close_price.index[-1], mtimes
+
+@st.cache_data(ttl=3600)
+def _log_close(_close_arr, data_version):
+    """
+    Log prices of the full series; any Buy & Hold curve is then exp(log[i:j] - log[i]).
+    """
+    return np.log(_close_arr)
+
+@st.cache_data(ttl=3600)
+def _compute_signals(_close_price, short_window, long_window, data_version):
+    """
+    Calculate SMA crossover signals on the given (warm-up) series.
+    Cached per window pair; `_close_price` is skipped by the hasher and
+    `data_version` stands in for it in the cache key.
+    """
+    # Both SMAs and the crossover compare fused into a single Numba pass
+    entries, exits = sma_cross(_close_price.to_numpy(dtype=np.float64), short_window, long_window)
+    return entries, exits
+
+def _run_portfolio(close_price, entries, exits, start_date=None, end_date=None):
+    close_arr = close_price.to_numpy(dtype=np.float64)
+
+    # Slice to User's Selected Range (positions on the sorted index)
     if start_date and end_date:
-        ts_start = pd.Timestamp(start_date)
-        ts_end = pd.Timestamp(end_date)
-        
-        # Slice aligned data
-        close_slice = close_price.loc[ts_start:ts_end]
-        entries_slice = entries.loc[ts_start:ts_end]
-        exits_slice = exits.loc[ts_start:ts_end]
+        i = close_price.index.searchsorted(pd.Timestamp(start_date))
+        j = close_price.index.searchsorted(pd.Timestamp(end_date), side="right")
     else:
-        close_slice = close_price
-        entries_slice = entries
-        exits_slice = exits
+        i, j = 0, len(close_arr)
 
-    # 3. Simulate Portfolio on the Sliced Period
-    if close_slice.empty:
+    # Simulate Portfolio on the Sliced Period
+    if j <= i:
         return None
+
+    # Views into the shared buffers, aligned on the same index slice
+    idx = close_price.index[i:j]
+    close_slice = pd.Series(close_arr[i:j], index=idx, name=close_price.name, copy=False)
+    entries_slice = pd.Series(entries[i:j], index=idx, copy=False)
+    exits_slice = pd.Series(exits[i:j], index=idx, copy=False)
         
     portfolio = vbt.Portfolio.from_signals(close_slice, entries_slice, exits_slice, init_cash=100_000, freq='D')
     return portfolio
 
+# Backtest Function (with Warm-up)
+def sma_crossover_backtest(close_price, short_window=50, long_window=200, start_date=None, end_date=None):
+    # 1. Keep only the Selected Range plus a Warm-up seed.
+    # SMA depends only on the trailing window, so older history doesn't change the signals.
+    if start_date and end_date:
+        warmup_bars = max(short_window, long_window) + 5
+        i = max(close_price.index.searchsorted(pd.Timestamp(start_date)) - warmup_bars, 0)
+        j = close_price.index.searchsorted(pd.Timestamp(end_date), side="right")
+        close_warm = close_price.iloc[i:j]
+    else:
+        close_warm = close_price
+
+    if close_warm.empty:
+        return None
+
+    # 2. Calculate Indicators on the Warm-up Series (cached across reruns)
+    entries, exits = _compute_signals(
+        close_warm, short_window, long_window, _data_version(close_warm)
+    )
+
+    # 3. Slice & Simulate Portfolio on the Selected Period
+    return _run_portfolio(close_warm, entries, exits, start_date, end_date)
+
+@st.cache_resource(max_entries=16)
+def _simulate(_close_price, data_version, short_window, long_window, start_iso, end_iso):
+    """
+    Cached Portfolio for one set of settings.
+    Re-clicking "Run Analysis" with the same parameters skips the simulation.
+    """
+    return sma_crossover_backtest(
+        _close_price,
+        short_window=short_window,
+        long_window=long_window,
+        start_date=start_iso,
+        end_date=end_iso
+    )
+
+@st.cache_data(max_entries=16)
+def _portfolio_metrics(_pf, sim_key):
+    """
+    The four metrics shown on the dashboard, read directly from the Portfolio
+    (same values as the matching `pf.stats()` rows, without building the full table).
+    Memoized for the cached Portfolio identified by `sim_key`.
+    """
+    total_return = float(_pf.total_return()) * 100
+    trades = int(_pf.trades.count())
+    closed_trades = int(_pf.trades.closed.count())
+    win_rate = float(_pf.trades.closed.win_rate()) * 100 if closed_trades else float('nan')
+    max_dd = -float(_pf.max_drawdown()) * 100
+    return total_return, win_rate, trades, max_dd
+
+PERIOD_DAYS = {
+    "Last 1 Year": 365,
+    "Last 3 Years": 365 * 3,
+    "Last 5 Years": 365 * 5,
+    "All Time (Max)": 365 * 50
+}
+
+@st.cache_data(max_entries=2)
+def _period_map(today):
+    """
+    {period name: (start_date, end_date)} for every Backtest Period option.
+    Start Date = End Date - selected days; End Date is always yesterday.
+    `today` is part of the cache key, so the map rolls over at midnight.
+    """
+    today = pd.Timestamp(today)
+    yesterday = today - pd.Timedelta(days=1)
+    return {name: (yesterday - pd.Timedelta(days=days), yesterday) for name, days in PERIOD_DAYS.items()}
+
 # ==========================================
 # UI LAYOUT
 # ==========================================
@@ -102,28 +232,16 @@ if page == "Dashboard":
     strategy_option = st.sidebar.selectbox("Select Strategy", ["SMA Crossover"])
     
     st.sidebar.subheader("Strategy Parameters")
-    short_window = st.sidebar.number_input("Short Window (SMA)", value=50, step=1)
-    long_window = st.sidebar.number_input("Long Window (SMA)", value=200, step=1)
+    short_window = st.sidebar.number_input("Short Window (SMA)", min_value=1, value=50, step=1)
+    long_window = st.sidebar.number_input("Long Window (SMA)", min_value=1, value=200, step=1)
     
     st.sidebar.subheader("Backtest Period")
     
     # SIMPLIFIED: Fixed Period Selector (No more confusing Date Pickers)
-    period_days = {
-        "Last 1 Year": 365,
-        "Last 3 Years": 365 * 3,
-        "Last 5 Years": 365 * 5,
-        "All Time (Max)": 365 * 50
-    }
-    selected_period = st.sidebar.selectbox("Select Duration", list(period_days.keys()))
-    
-    # Calculate Dates based on selection
-    today = pd.Timestamp.now().normalize()
-    yesterday = today - pd.Timedelta(days=1)
+    selected_period = st.sidebar.selectbox("Select Duration", list(PERIOD_DAYS.keys()))
     
-    # Logic: Start Date = End Date - selected days
-    days_to_subtract = period_days[selected_period]
-    start_date = yesterday - pd.Timedelta(days=days_to_subtract)
-    end_date = yesterday # Always up to yesterday
+    # Look up Dates for the selection
+    start_date, end_date = _period_map(datetime.date.today())[selected_period]
     
     run_bt = st.sidebar.button("🚀 Run Analysis", use_container_width=True)
 
@@ -132,7 +250,7 @@ if page == "Dashboard":
             close, source = get_close_data()
             
             # Data Cleaning (Robustness)
-            close = close.ffill().dropna()
+            close = _ffill_trim(close)
 
             if close.empty:
                 st.error("❌ No data available. Please check `sp500_market_data.csv`.")
@@ -144,35 +262,39 @@ if page == "Dashboard":
             st.markdown("### 📊 Market Trend & Strategy Indicators")
             st.caption(f"Showing market trends from Year 2000 to Present. Green/Red lines act as the 'Strategy Signals'.")
             
+            # One float64 buffer (a view, not a copy) shared by SMAs, plot, benchmark & backtest
+            close_arr, close_idx = close.to_numpy(dtype=np.float64), close.index
+
             # Calculate Indicators on FULL DATA
-            full_sma_short = close.rolling(window=short_window).mean()
-            full_sma_long = close.rolling(window=long_window).mean()
+            full_sma_short = sma_running(close_arr, short_window)
+            full_sma_long = sma_running(close_arr, long_window)
             
-            # Plot Data (Filter to 2000+)
+            # Plot Data (Filter to 2000+): trim the arrays first, build the frame once
+            cutoff = close_idx.searchsorted(pd.Timestamp("2000-01-01")) # User requested starting from 2000
             plot_data = pd.DataFrame({
-                "Price": close,
-                f"SMA {short_window}": full_sma_short,
-                f"SMA {long_window}": full_sma_long
-            })
-            plot_data = plot_data[plot_data.index >= "2000-01-01"] # User requested starting from 2000
+                "Price": close_arr[cutoff:],
+                f"SMA {short_window}": full_sma_short[cutoff:],
+                f"SMA {long_window}": full_sma_long[cutoff:]
+            }, index=close_idx[cutoff:])
             
             st.line_chart(plot_data, color=["#ffffff", "#00ff00", "#ff0000"])
 
             # ---------------------------------------------------------
             # 2. RUN BACKTEST (Specific Period)
             # ---------------------------------------------------------
-            pf = sma_crossover_backtest(
-                close, 
-                short_window=short_window, 
-                long_window=long_window,
-                start_date=start_date,
-                end_date=end_date
+            sim_key = (
+                _data_version(close),
+                short_window,
+                long_window,
+                start_date.isoformat(),
+                end_date.isoformat()
             )
+            pf = _simulate(close, *sim_key)
             
             if pf is None or len(pf.close) == 0:
                 st.error("❌ No data found for the selected period.")
             else:
-                stats = pf.stats()
+                total_return, win_rate, trades, max_dd = _portfolio_metrics(pf, sim_key)
                 
                 # Check for insufficient data
                 if len(pf.close) < 20:
@@ -190,11 +312,6 @@ if page == "Dashboard":
                     if pd.isna(val) or np.isinf(val): return "N/A"
                     return f"{val:.2f}%" if is_pct else f"{val:.2f}"
 
-                total_return = stats['Total Return [%]']
-                win_rate = stats['Win Rate [%]']
-                trades = stats['Total Trades']
-                max_dd = stats['Max Drawdown [%]']
-
                 with col1: st.metric("Total Return", fmt(total_return, True))
                 
                 # CONDITIONAL METRIC: Show "Win Rate" only if available.
@@ -244,11 +361,13 @@ if page == "Dashboard":
                 # Rebase Benchmark (S&P 500 Buy & Hold)
                 ts_start = pd.Timestamp(start_date)
                 ts_end = pd.Timestamp(end_date)
-                close_slice = close.loc[ts_start:ts_end]
+                i = close_idx.searchsorted(ts_start)
+                j = close_idx.searchsorted(ts_end, side="right")
                 
-                if not close_slice.empty:
-                    benchmark_ret = close_slice.pct_change().fillna(0)
-                    equity_df["Benchmark (Buy & Hold)"] = (1 + benchmark_ret).cumprod() * 100_000
+                if j > i:
+                    log_close = _log_close(close_arr, _data_version(close))
+                    bench = 100_000 * np.exp(log_close[i:j] - log_close[i])
+                    equity_df["Benchmark (Buy & Hold)"] = pd.Series(bench, index=close_idx[i:j], copy=False)
                     st.line_chart(equity_df, color=["#2ECC71", "#E74C3C"])
                 
                 # Calculate final values for the text
@@ -337,8 +456,8 @@ elif page == "About Project":
     
     col1, col2 = st.columns(2)
     with col1:
-        if "CSV" in source:
-            st.info(f"**Data Source:** CSV (Demo Mode)")
+        if "Static Demo" in source:
+            st.info(f"**Data Source:** {source.split(' ')[0]} (Demo Mode)")
         elif "PostgreSQL" in source:
             st.success(f"**Data Source:** PostgreSQL (Live)")
         else:
@@ -0,0 +1,48 @@
+"""
+db_config.py
+============
+
+PostgreSQL connection settings shared by the dashboard and the pipeline.
+
+The .env file and environment are read once per process; every caller gets
+the same frozen `DBConfig` (or `None` when the database isn't configured).
+"""
+
+import os
+import functools
+from dataclasses import dataclass, field
+from typing import Optional
+
+from dotenv import load_dotenv
+
+
+@dataclass(frozen=True)
+class DBConfig:
+    user: str
+    password: str = field(repr=False)
+    host: str
+    port: str
+    name: str
+
+    @property
+    def uri(self) -> str:
+        return f"postgresql+psycopg2://{self.user}:{self.password}@{self.host}:{self.port}/{self.name}"
+
+
+@functools.lru_cache(maxsize=1)
+def db_config() -> Optional[DBConfig]:
+    """
+    Connection settings from .env / environment (DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME).
+    Returns None if any of them is missing; the result is cached either way.
+    """
+    load_dotenv()
+    try:
+        return DBConfig(
+            user=os.environ["DB_USER"],
+            password=os.environ["DB_PASSWORD"],
+            host=os.environ["DB_HOST"],
+            port=os.environ["DB_PORT"],
+            name=os.environ["DB_NAME"],
+        )
+    except KeyError:
+        return None
@@ -1,5 +1,7 @@
 import yfinance as yf
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 def fetch_and_save():
     print("Fetching full S&P 500 history...")
@@ -18,5 +20,10 @@ def fetch_and_save():
     df.to_csv(output_path, index=False)
     print(f"Saved {len(df)} rows to {output_path}")
 
+    # Parquet snapshot (preferred by the dashboard when present)
+    parquet_path = "sp500_market_data.parquet"
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), parquet_path, compression="zstd")
+    print(f"Saved {len(df)} rows to {parquet_path}")
+
 if __name__ == "__main__":
     fetch_and_save()
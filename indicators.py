@@ -0,0 +1,78 @@
+"""
+indicators.py
+=============
+
+Numba-compiled indicator kernels shared by the dashboard and the pipeline.
+
+Functions:
+- sma_running() → Simple Moving Average via a running sum (O(N), single pass)
+- sma_cross()   → SMA crossover entries/exits, both SMAs fused into one pass
+"""
+
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True)
+def sma_running(x: np.ndarray, w: int) -> np.ndarray:
+    """
+    Simple Moving Average of `x` over `w` bars.
+
+    Matches `pd.Series(x).rolling(window=w).mean()` for NaN-free input:
+    the first `w - 1` values are NaN. Raises ValueError if `w < 1`.
+    """
+    if w < 1:
+        raise ValueError("window must be >= 1")
+    n = x.shape[0]
+    out = np.empty(n, dtype=np.float64)
+    out[:w - 1] = np.nan
+
+    running_sum = 0.0
+    for i in range(min(w - 1, n)):
+        running_sum += x[i]
+    for i in range(w - 1, n):
+        running_sum += x[i]
+        if i >= w:
+            running_sum -= x[i - w]
+        out[i] = running_sum / w
+    return out
+
+
+@njit(cache=True, fastmath=True)
+def sma_cross(x: np.ndarray, ws: int, wl: int):
+    """
+    Crossover signals of a fast (`ws`) and slow (`wl`) SMA of `x`.
+
+    entries[i]: fast crosses above slow (fast[i] > slow[i] and fast[i-1] <= slow[i-1])
+    exits[i]:   fast crosses below slow (fast[i] < slow[i] and fast[i-1] >= slow[i-1])
+    No signal is emitted until both SMAs are defined on bars i-1 and i.
+    Raises ValueError if either window is < 1.
+    """
+    if ws < 1 or wl < 1:
+        raise ValueError("windows must be >= 1")
+    n = x.shape[0]
+    entries = np.zeros(n, dtype=np.bool_)
+    exits = np.zeros(n, dtype=np.bool_)
+    w_max = max(ws, wl)
+
+    sum_s = 0.0
+    sum_l = 0.0
+    prev_fast = 0.0
+    prev_slow = 0.0
+    for i in range(n):
+        sum_s += x[i]
+        if i >= ws:
+            sum_s -= x[i - ws]
+        sum_l += x[i]
+        if i >= wl:
+            sum_l -= x[i - wl]
+
+        if i >= w_max - 1:
+            fast = sum_s / ws
+            slow = sum_l / wl
+            if i >= w_max:
+                entries[i] = fast > slow and prev_fast <= prev_slow
+                exits[i] = fast < slow and prev_fast >= prev_slow
+            prev_fast = fast
+            prev_slow = slow
+    return entries, exits
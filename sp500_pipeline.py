@@ -13,23 +13,59 @@ Pipeline สำหรับดึงข้อมูลหุ้น S&P500 จา
 2. รัน: python sp500_pipeline.py
 
 Tasks:
-- Task 1: fetch_sp500_data()      → ดึงข้อมูลจาก Yahoo Finance
+- Task 1: fetch_sp500_data()      → ดึงข้อมูลจาก Yahoo Finance (incremental ถ้ามีข้อมูลใน DB แล้ว)
 - Task 2: clean_data()             → ทำความสะอาดข้อมูลก่อนวิเคราะห์
 - Task 3: calculate_moving_averages() → คำนวณค่า MA
 - Task 4: save_to_postgres()       → บันทึกข้อมูลลง PostgreSQL
 - Task 5: export_latest_data()     → export ข้อมูลล่าสุด 100 แถวเป็น CSV
 """
 
+import numpy as np
 import pandas as pd
 import yfinance as yf
+from pandas.tseries.offsets import BDay
 from sqlalchemy import create_engine, text
 from prefect import task, flow
 from datetime import datetime
-import os
-from dotenv import load_dotenv
+import csv
+import functools
+from io import StringIO
+from indicators import sma_running
+from db_config import db_config
+
+@functools.lru_cache(maxsize=1)
+def _engine():
+    """
+    SQLAlchemy engine เดียวของทั้ง process (มี connection pool)
+    สร้างครั้งแรกที่ถูกเรียก แล้วใช้ซ้ำทุก task แทนการ create_engine ใหม่ทุกครั้ง
+    """
+    cfg = db_config()
+    if cfg is None:
+        raise ValueError("ไม่พบการตั้งค่า DB ครบ (DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME)")
+    return create_engine(cfg.uri, pool_size=5, pool_pre_ping=True, pool_recycle=300)
+
+# ช่วง Moving Average ที่คำนวณ (ใช้กำหนด warm-up ตอนดึงข้อมูลแบบ incremental ด้วย)
+MA_WINDOWS = [20, 50, 100, 200]
 
-# โหลด Environment Variables
-load_dotenv()
+def _get_last_date(table_name="sp500_prices"):
+    """
+    ดึงวันที่ล่าสุดที่บันทึกไว้ใน table (คืน None ถ้า table ยังไม่มีหรือยังว่าง)
+    """
+    try:
+        with _engine().connect() as conn:
+            return conn.execute(text(f"SELECT MAX(date) FROM {table_name}")).scalar()
+    except Exception as e:
+        if "relation" in str(e) and "does not exist" in str(e):
+            print(f"[DB] ตาราง '{table_name}' ยังไม่มีอยู่ จะสร้างใหม่ทั้งหมด")
+            return None
+        raise e
+
+def _get_recent_rows(n, table_name="sp500_prices"):
+    """
+    ดึง n แถวล่าสุดจาก table (เรียงตามวันที่จากเก่าไปใหม่) ใช้เป็น warm-up สำหรับคำนวณ MA
+    """
+    query = f"SELECT * FROM {table_name} ORDER BY date DESC LIMIT {int(n)}"
+    return pd.read_sql(query, con=_engine()).iloc[::-1].reset_index(drop=True)
 
 # ===========================
 # Task 1: Fetch ข้อมูล S&P500
@@ -38,27 +74,53 @@ load_dotenv()
 def fetch_sp500_data(period: str = "max", interval: str = "1d") -> pd.DataFrame:
     """
     ดึงข้อมูลราคาหุ้น S&P500 จาก Yahoo Finance
+    - ถ้าข้อมูลใน DB เป็นปัจจุบันแล้ว (ถึงวันทำการก่อนหน้า): ไม่ดึงข้อมูล คืน DataFrame ว่าง
+    - ถ้าใน DB มีข้อมูลแล้ว: ดึงเฉพาะวันหลังวันที่ล่าสุด แล้วต่อท้ายจาก
+      max(MA_WINDOWS) แถวล่าสุดใน DB (warm-up สำหรับคำนวณ MA)
+    - ถ้ายังไม่มี (bootstrap ครั้งแรก): ดึงตาม period
 
     Args:
-        period (str): ช่วงข้อมูลที่ต้องการ ('max', '1y', '3mo' เป็นต้น)
+        period (str): ช่วงข้อมูลที่ต้องการตอน bootstrap ('max', '1y', '3mo' เป็นต้น)
         interval (str): ความถี่ของข้อมูล ('1d' สำหรับรายวัน)
 
     Returns:
         pd.DataFrame: ข้อมูลราคาหุ้น พร้อมคอลัมน์ date, Open, High, Low, Close, Volume
+                      (ว่างถ้าไม่มีข้อมูลใหม่)
     """
     ticker = "^GSPC"
-    df = yf.download(ticker, period=period, interval=interval)
+    last_date = _get_last_date()
+    if last_date is not None:
+        last_date = pd.Timestamp(last_date)
+        if last_date >= pd.Timestamp.today().normalize() - BDay(1):
+            print(f"[Fetch] ข้อมูลใน DB เป็นปัจจุบันแล้ว ({last_date.date()}) ข้ามการดึงข้อมูล")
+            return pd.DataFrame()
+
+        start = (last_date + BDay(1)).date()
+        print(f"[Fetch] ดึงข้อมูลเพิ่มเติมตั้งแต่ {start} (ล่าสุดใน DB: {last_date.date()})")
+        df = yf.download(ticker, start=start, interval=interval)
+    else:
+        df = yf.download(ticker, period=period, interval=interval)
 
     # Flatten MultiIndex columns ถ้ามี
     if isinstance(df.columns, pd.MultiIndex):
         df.columns = [col[0] for col in df.columns]
 
     if df.empty:
+        if last_date is not None:
+            print("[Fetch] ไม่มีข้อมูลใหม่จาก Yahoo Finance")
+            return pd.DataFrame()
         raise ValueError("ไม่พบข้อมูลจาก Yahoo Finance")
 
     df.reset_index(inplace=True)
     df.rename(columns={"Date": "date"}, inplace=True)
 
+    if last_date is not None:
+        # MA_200 ของแถวใหม่ต้องใช้ราคาย้อนหลัง: อ่านจาก DB แทนการดึงซ้ำจาก Yahoo
+        # แถวเหล่านี้จะถูกตัดทิ้งใน save_to_postgres (date <= MAX(date))
+        history = _get_recent_rows(max(MA_WINDOWS))
+        history = history[[col for col in df.columns if col in history.columns]]
+        df = pd.concat([history, df], ignore_index=True)
+
     print(f"[Fetch] ข้อมูลล่าสุด: {df['date'].max()}")
     return df
 
@@ -71,32 +133,36 @@ def clean_data(df: pd.DataFrame) -> pd.DataFrame:
     ทำความสะอาดข้อมูลก่อนนำไปวิเคราะห์หรือบันทึกลงฐานข้อมูล
 
     Steps:
-    1. ลบค่า NaN ในคอลัมน์สำคัญที่มีอยู่จริง
-    2. แปลง date column เป็น datetime
-    3. ลบข้อมูลซ้ำตามวันที่
-    4. เรียงลำดับข้อมูลตามวันที่
-    5. กรองข้อมูลราคาหรือปริมาณติดลบ
+    1. แปลง date column เป็น datetime
+    2. ลบค่า NaN และกรองข้อมูลราคาหรือปริมาณติดลบ (mask เดียว)
+    3. ลบข้อมูลซ้ำตามวันที่ และเรียงลำดับตามวันที่ (np.unique ครั้งเดียว)
+
+    ทำงานบน numpy array ของแต่ละคอลัมน์ แล้วสร้าง DataFrame ใหม่ครั้งเดียวตอนท้าย
     """
     # กำหนดคอลัมน์สำคัญ
     required_cols = ["Open", "High", "Low", "Close", "Volume"]
     # เลือกเฉพาะคอลัมน์ที่มีอยู่จริง
     existing_cols = [col for col in required_cols if col in df.columns]
 
-    # ลบค่า NaN
-    df = df.dropna(subset=existing_cols)
-
     # แปลง date เป็น datetime
-    df["date"] = pd.to_datetime(df["date"])
+    dates = pd.to_datetime(df["date"]).array
 
-    # ลบข้อมูลซ้ำตามวันที่
-    df = df.drop_duplicates(subset=["date"], keep="last")
+    # ลบค่า NaN และข้อมูลติดลบในรอบเดียว
+    values = [df[col].to_numpy(dtype=np.float64) for col in existing_cols]
+    mask = np.logical_and.reduce(
+        [np.ones(len(df), dtype=bool)] + [np.isfinite(v) & (v >= 0) for v in values]
+    )
+    rows = np.flatnonzero(mask)
 
-    # เรียงลำดับ
-    df = df.sort_values(by="date").reset_index(drop=True)
+    # ลบข้อมูลซ้ำตามวันที่ (keep="last") + เรียงลำดับ:
+    # np.unique บน array ที่กลับด้านจะได้ index ของแถวสุดท้ายของแต่ละวัน เรียงตามวันที่
+    _, first_rev = np.unique(dates[rows][::-1].to_numpy(), return_index=True)
+    rows = rows[len(rows) - 1 - first_rev]
 
-    # กรองข้อมูลติดลบ
-    for col in existing_cols:
-        df = df[df[col] >= 0]
+    df = pd.DataFrame({
+        col: (dates[rows] if col == "date" else df[col].array[rows])
+        for col in df.columns
+    })
 
     print(f"[Clean] หลังทำความสะอาดเหลือ {len(df)} แถว")
     return df
@@ -105,7 +171,7 @@ def clean_data(df: pd.DataFrame) -> pd.DataFrame:
 # Task 3: คำนวณ Moving Average
 # ===========================
 @task
-def calculate_moving_averages(df: pd.DataFrame, windows=[20, 50, 100, 200]) -> pd.DataFrame:
+def calculate_moving_averages(df: pd.DataFrame, windows=MA_WINDOWS) -> pd.DataFrame:
     """
     คำนวณค่า Moving Average (MA) ของราคาปิด
 
@@ -116,9 +182,10 @@ def calculate_moving_averages(df: pd.DataFrame, windows=[20, 50, 100, 200]) -> p
     Returns:
         pd.DataFrame: เพิ่มคอลัมน์ MA_20, MA_50, MA_100, MA_200
     """
-    for w in windows:
-        if "Close" in df.columns:
-            df[f"MA_{w}"] = df["Close"].rolling(window=w).mean()
+    if "Close" in df.columns:
+        # อ่าน Close ครั้งเดียว แล้วเพิ่มคอลัมน์ MA ทั้งหมดพร้อมกัน
+        close_arr = df["Close"].to_numpy(dtype=np.float64)
+        df = df.assign(**{f"MA_{w}": sma_running(close_arr, w) for w in windows})
 
     print(f"[MA] ตัวอย่างข้อมูล:\n{df.tail(3)}")
     return df
@@ -126,41 +193,67 @@ def calculate_moving_averages(df: pd.DataFrame, windows=[20, 50, 100, 200]) -> p
 # ===========================
 # Task 4: Save ลง PostgreSQL
 # ===========================
+def _psql_insert_copy(table, conn, keys, data_iter):
+    """
+    method สำหรับ DataFrame.to_sql: ส่งข้อมูลด้วย COPY ... FROM STDIN
+    แทน INSERT ทีละแถว (ลด round trip ไปยัง PostgreSQL)
+    """
+    dbapi_conn = conn.connection
+    with dbapi_conn.cursor() as cur:
+        s_buf = StringIO()
+        writer = csv.writer(s_buf)
+        writer.writerows(data_iter)
+        s_buf.seek(0)
+
+        columns = ", ".join(f'"{k}"' for k in keys)
+        if table.schema:
+            table_name = f"{table.schema}.{table.name}"
+        else:
+            table_name = table.name
+
+        sql = f"COPY {table_name} ({columns}) FROM STDIN WITH CSV"
+        cur.copy_expert(sql=sql, file=s_buf)
+
+def _ensure_date_index(engine, table_name):
+    """
+    สร้าง btree index บนคอลัมน์ date (ครั้งเดียว) เพื่อให้ MAX(date) เป็น index-only scan
+    """
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {table_name}_date_idx ON {table_name} (date)"))
+
 @task
 def save_to_postgres(df: pd.DataFrame, table_name="sp500_prices"):
     """
     บันทึกข้อมูลลง PostgreSQL
     - สร้าง table ถ้าไม่เคยมี
     - append เฉพาะข้อมูลใหม่
+    - สร้าง index บน date ถ้ายังไม่มี
+
+    หมายเหตุ: df ต้องเรียงตาม date แล้ว (ผ่าน clean_data)
     """
-    db_uri = (
-        f"postgresql+psycopg2://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
-        f"@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
-    )
-    engine = create_engine(db_uri)
+    engine = _engine()
 
-    last_date = None
-    try:
-        with engine.connect() as conn:
-            result = conn.execute(text(f"SELECT MAX(date) FROM {table_name}"))
-            last_date = result.scalar()
-    except Exception as e:
-        if "relation" in str(e) and "does not exist" in str(e):
-            print(f"[DB] ตาราง '{table_name}' ยังไม่มีอยู่ จะสร้างใหม่ทั้งหมด")
-        else:
-            raise e
+    last_date = _get_last_date(table_name)
 
     if last_date:
-        df_new = df[df["date"] > pd.to_datetime(last_date)]
+        # date เรียงแล้ว จึงใช้ binary search แทนการ scan ทั้ง DataFrame
+        idx = np.searchsorted(df["date"].values, pd.Timestamp(last_date).to_datetime64(), side="right")
+        df_new = df.iloc[idx:]
     else:
         df_new = df
 
     if not df_new.empty:
-        df_new.to_sql(table_name, con=engine, if_exists="append", index=False)
+        df_new.to_sql(
+            table_name, con=engine, if_exists="append", index=False,
+            method=_psql_insert_copy, chunksize=10_000
+        )
         print(f"[DB] บันทึกข้อมูลใหม่ {len(df_new)} แถว")
     else:
         print("[DB] ไม่มีข้อมูลใหม่ให้บันทึก")
 
+    if last_date is not None or not df_new.empty:
+        _ensure_date_index(engine, table_name)
+
 # ===========================
 # Task 5: Export ข้อมูลล่าสุด 100 แถว
 # ===========================
@@ -168,20 +261,21 @@ def save_to_postgres(df: pd.DataFrame, table_name="sp500_prices"):
 def export_latest_data(table_name="sp500_prices", output_file="sp500_latest.csv", limit=100):
     """
     ดึงข้อมูลล่าสุดจาก PostgreSQL และ export เป็นไฟล์ CSV
+    ให้ PostgreSQL encode CSV เองผ่าน COPY ... TO STDOUT (ไม่ต้องผ่าน pandas)
     """
-    db_uri = (
-        f"postgresql+psycopg2://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}"
-        f"@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
-    )
-    engine = create_engine(db_uri)
-
     query = f"""
-        SELECT * FROM {table_name}
-        ORDER BY date DESC
-        LIMIT {limit};
+        COPY (
+            SELECT * FROM {table_name}
+            ORDER BY date DESC
+            LIMIT {int(limit)}
+        ) TO STDOUT WITH CSV HEADER
     """
-    df = pd.read_sql(query, con=engine)
-    df.to_csv(output_file, index=False)
+    conn = _engine().raw_connection()
+    try:
+        with conn.cursor() as cur, open(output_file, "w", newline="") as f:
+            cur.copy_expert(query, f)
+    finally:
+        conn.close()
     print(f"[Export] บันทึกไฟล์ล่าสุด {limit} แถว -> {output_file}")
     return output_file
 
@@ -198,14 +292,17 @@ def run_pipeline():
     # Task 1: ดึงข้อมูล
     df = fetch_sp500_data()
 
-    # Task 2: ทำความสะอาด
-    df = clean_data(df)
+    if df.empty:
+        print("[Pipeline] ไม่มีข้อมูลใหม่ ข้าม Task 2-4")
+    else:
+        # Task 2: ทำความสะอาด
+        df = clean_data(df)
 
-    # Task 3: คำนวณ MA
-    df = calculate_moving_averages(df)
+        # Task 3: คำนวณ MA
+        df = calculate_moving_averages(df)
 
-    # Task 4: บันทึกลง DB
-    save_to_postgres(df)
+        # Task 4: บันทึกลง DB
+        save_to_postgres(df)
 
     # Task 5: Export ข้อมูลล่าสุด
     export_latest_data()